@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# index.py creates its reports dir and session DB relative to the working
+# directory at import time, so import it from a scratch directory.
+os.chdir(tempfile.mkdtemp())
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("SESSION_STORE", "memory")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "api"))
@@ -0,0 +1,69 @@
+import index
+
+
+def test_split_and_join_turns_round_trip():
+    transcript = "intro\n\nSALES REP: Hello there\n\nCUSTOMER: Hi, I want a ruby"
+    turns = index.split_turns(transcript)
+    assert turns == [[None, "intro"], ["SALES REP", "Hello there"], ["CUSTOMER", "Hi, I want a ruby"]]
+    assert index.join_turns(turns) == transcript
+
+
+def test_fit_transcript_strips_fillers():
+    fitted, stats = index.fit_transcript("SALES REP: Um, hello, uh, what is your budget?", budget=0)
+    assert fitted == "SALES REP: hello, what is your budget?"
+    assert stats["fillers"] == 2
+
+
+def test_fit_transcript_folds_repeated_turns():
+    transcript = index.join_turns([
+        ["SALES REP", "What is your budget for the stone?"],
+        ["CUSTOMER", "Not sure yet"],
+        ["SALES REP", "What is your budget for the stone?"],
+    ])
+    fitted, stats = index.fit_transcript(transcript, budget=0)
+    assert stats["repeats"] == 1
+    assert index.split_turns(fitted) == [
+        ["SALES REP", "What is your budget for the stone? [said 2 times]"],
+        ["CUSTOMER", "Not sure yet"],
+    ]
+
+
+def test_fit_transcript_omits_middle_turns_over_budget():
+    keep = index.TRANSCRIPT_KEEP_TURNS
+    words = "ruby emerald sapphire pearl coral garnet topaz opal onyx jade amber quartz".split()
+    turns = [["SALES REP" if i % 2 else "CUSTOMER", " ".join(words[(i + j * 5) % len(words)] + str(i * 40 + j)
+                                                            for j in range(40))]
+             for i in range(4 * keep)]
+    transcript = index.join_turns(turns)
+    fitted, stats = index.fit_transcript(transcript, budget=index.count_tokens(transcript) // 2)
+    assert fitted.startswith(index.join_turns(turns[:keep]))
+    assert fitted.endswith(index.join_turns(turns[-keep:]))
+    assert stats["omitted_turns"] > 0
+    assert "turns omitted ...]" in fitted
+    assert stats["tokens_after"] < stats["tokens_before"]
+
+
+def test_fit_transcript_leaves_short_transcript_alone():
+    transcript = "SALES REP: Hello\n\nCUSTOMER: Hi"
+    fitted, stats = index.fit_transcript(transcript)
+    assert fitted == transcript
+    assert stats["tokens_saved"] == 0
+
+
+def test_omitted_turns_leave_their_amounts_and_keywords():
+    keep = index.TRANSCRIPT_KEEP_TURNS
+    filler = [["SALES REP" if i % 2 else "CUSTOMER", f"Small talk number {i} about the weather and traffic"]
+              for i in range(2 * keep)]
+    objection = [
+        ["SALES REP", "This certified ruby is Rs. 45,000 for 3.5 ratti"],
+        ["CUSTOMER", "That's too expensive, I saw it cheaper online"],
+    ]
+    turns = filler[:keep] + objection + filler[keep:]
+    fitted, stats = index.fit_transcript(index.join_turns(turns), budget=1)
+    assert stats["omitted_turns"] == 2
+    assert ("[... 2 turns omitted: SALES REP mentioned Rs. 45,000, 3.5 ratti, certified; "
+            "CUSTOMER mentioned expensive, cheaper, online ...]") in fitted
+
+
+def test_omitted_note_without_signals():
+    assert index._omitted_note([["CUSTOMER", "okay fine"]]) == "[... 1 turns omitted ...]"
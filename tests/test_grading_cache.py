@@ -0,0 +1,108 @@
+import pytest
+
+import index
+
+RAW_GRADING = {
+    "s": {"op": 70, "nd": 65, "bq": 60, "br": 55, "oh": 50, "pr": 75, "ch": 40}, "ls": "WARM",
+    "sum": "Good opening, weak close.", "st": ["Warm greeting"], "im": ["Ask for the budget"], "ra": "Thin discovery.",
+    "cp": {"in": "Researcher", "la": "Hinglish", "pe": "Trust-Builder", "bg": "Traditional", "hb": "Rs.1-Rs.2"},
+    "ps": {"fu": "Research Mode", "la": "Hinglish", "em": "Calm", "di": False},
+    "dc": {"pu": "gift", "bu": "Unknown", "ti": "Unknown", "pf": "Unknown"},
+}
+
+
+def test_grading_cache_round_trip(tmp_path):
+    cache = index.GradingCache(tmp_path, max_bytes=10_000)
+    assert cache.get("k1") is None
+    cache.put("k1", index.expand_grading(RAW_GRADING)[0], {"model": "m"})
+    entry = cache.get("k1")
+    assert entry["grading"] == index.expand_grading(RAW_GRADING)[0]
+    assert entry["grading_meta"] == {"model": "m"}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stores"], stats["entries"]) == (1, 1, 1, 1)
+
+
+def test_grading_cache_evicts_least_recently_used(tmp_path):
+    cache = index.GradingCache(tmp_path, max_bytes=10_000)
+    cache.put("k1", {"sum": "x" * 100}, {})
+    size = cache.stats()["bytes"]
+    cache = index.GradingCache(tmp_path, max_bytes=size * 2 + size // 2)
+    cache.put("k2", {"sum": "y" * 100}, {})
+    cache.get("k1")
+    cache.put("k3", {"sum": "z" * 100}, {})
+    assert cache.get("k2") is None
+    assert not (tmp_path / "k2.json").exists()
+    assert cache.get("k1") is not None
+    assert cache.get("k3") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_grading_cache_reloads_index_from_disk(tmp_path):
+    index.GradingCache(tmp_path, max_bytes=10_000).put("k1", {"ls": "HOT"}, {})
+    reopened = index.GradingCache(tmp_path, max_bytes=10_000)
+    assert reopened.stats()["entries"] == 1
+    assert reopened.get("k1")["grading"] == {"ls": "HOT"}
+
+
+def test_grading_cache_drops_unreadable_entry(tmp_path):
+    cache = index.GradingCache(tmp_path, max_bytes=10_000)
+    cache.put("k1", {"ls": "HOT"}, {})
+    (tmp_path / "k1.json").write_text("{broken", encoding="utf-8")
+    assert cache.get("k1") is None
+    assert cache.stats()["entries"] == 0
+
+
+@pytest.fixture
+def graded_calls(monkeypatch, tmp_path):
+    """Grading cache on, memory sessions, fake model calls counted in the returned list"""
+    monkeypatch.setattr(index, "grading_cache", index.GradingCache(tmp_path / "cache", max_bytes=1_000_000))
+    store = index.MemorySessionStore()
+    monkeypatch.setattr(index, "session_store", store)
+    monkeypatch.setattr(index, "SPECULATIVE_GRADING", True)
+    calls = []
+    
+    def grading_call(system_prompt, schema, session_prompt, timeout=None, on_field=None):
+        calls.append(session_prompt)
+        return dict(RAW_GRADING), {"prompt_tokens": 100, "cached_tokens": 0, "completion_tokens": 50, "repaired": False}
+    monkeypatch.setattr(index, "_grading_call", grading_call)
+    monkeypatch.setattr(index, "generate_pdf_report", lambda session: str(index.reports_dir / f"{session['id']}.pdf"))
+    for session_id in ("c1", "c2"):
+        store.save({"id": session_id, "personality": "ruby_customer", "status": "active",
+                    "created_at": "2026-01-01T00:00:00", "customer_profile": None, "transcript": None, "grading": None})
+    return calls
+
+
+def grade(session_id, force=False):
+    client = index.app.test_client()
+    reply = client.post("/api/session/grade", json={
+        "session_id": session_id, "personality": "ruby_customer", "duration": 75, "force": force,
+        "transcript": "SALES REP: Hello there, I am Raj\n\nCUSTOMER: Hi, I want a ruby"
+    }).get_json()
+    assert index.grading_jobs.wait_done(reply["job_id"], timeout=5)["status"] == "completed"
+    return index.session_store.get(session_id)["grading_meta"]
+
+
+def test_speculative_grading_reads_and_writes_the_cache(graded_calls):
+    first = grade("c1")
+    assert not first["cache_hit"] and first["speculative"]["used"]
+    second = grade("c2")
+    assert second["cache_hit"] and second["speculative"]["used"]
+    assert len(graded_calls) == 1
+    stats = index.grading_cache.stats()
+    assert (stats["hits"], stats["stores"]) == (1, 1)
+
+
+def test_force_regrades_and_refreshes_the_cache(graded_calls):
+    grade("c1")
+    forced = grade("c1", force=True)
+    assert not forced["cache_hit"]
+    assert len(graded_calls) == 2
+    assert index.grading_cache.stats()["stores"] == 2
+    assert grade("c2")["cache_hit"]
+
+
+def test_phased_gradings_are_not_cached(graded_calls):
+    prior = {"raw": {"s": {"op": 70}}, "calls": {}}
+    index.grade_transcript("ruby_customer", "SALES REP: Hello\n\nCUSTOMER: Hi there", 60, prior=prior)
+    stats = index.grading_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (0, 0, 0)
@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def client():
+    return index.app.test_client()
+
+
+@pytest.fixture
+def quick_wait(monkeypatch):
+    """SSE keep-alive after 10ms instead of 15s"""
+    jobs = index.grading_jobs
+    monkeypatch.setattr(jobs, "wait", lambda job_id, after, timeout: type(jobs).wait(jobs, job_id, after, 0.01))
+
+
+def sse_events(response):
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith(":"):
+            yield "comment", chunk.strip()
+        else:
+            name, data = chunk.strip().split("\n")
+            yield name[len("event: "):], json.loads(data[len("data: "):])
+
+
+def test_events_stream_progress_keep_alive_and_done(client, quick_wait):
+    job, created = index.grading_jobs.create_or_join("sse-session")
+    assert created
+    events = sse_events(client.get(f"/api/session/grade/{job['id']}/events", buffered=False))
+    
+    name, view = next(events)
+    assert (name, view["status"], view["stage"]) == ("progress", "queued", None)
+    assert next(events) == ("comment", ": keep-alive")
+    assert next(events) == ("comment", ": keep-alive")
+    
+    index.grading_jobs.set_stage(job["id"], "transcribe", "running")
+    name, view = next(events)
+    assert (name, view["stage"], view["stages"]["transcribe"]) == ("progress", "transcribe", "running")
+    
+    index.grading_jobs.update(job["id"], status="completed", stage=None, result={"score": 70})
+    name, view = next(events)
+    assert (name, view["status"], view["result"]) == ("done", "completed", {"score": 70})
+    assert next(events, None) is None
+
+
+def test_events_for_finished_job_end_at_once(client):
+    job, _ = index.grading_jobs.create_or_join("sse-failed")
+    index.grading_jobs.update(job["id"], status="failed", error="boom")
+    body = client.get(f"/api/session/grade/{job['id']}/events").get_data(as_text=True)
+    assert body.startswith("event: done\n")
+    assert '"error": "boom"' in body
+
+
+def test_events_for_unknown_job(client):
+    assert client.get("/api/session/grade/nope/events").status_code == 404
+
+
+def test_create_or_join_is_single_flight():
+    jobs = index.GradingJobs(ttl=60)
+    first, created = jobs.create_or_join("s1")
+    assert created
+    joined, created = jobs.create_or_join("s1", completed=lambda: pytest.fail("checked while a job is in flight"))
+    assert not created and joined["id"] == first["id"]
+    jobs.update(first["id"], status="failed", error="boom")
+    retry, created = jobs.create_or_join("s1")
+    assert created and retry["id"] != first["id"]
+
+
+def test_create_or_join_records_a_finished_grading():
+    jobs = index.GradingJobs(ttl=60)
+    job, created = jobs.create_or_join("s1", completed=lambda: {"score": 70})
+    assert not created
+    assert (job["status"], job["result"]) == ("completed", {"score": 70})
+    assert set(job["stages"].values()) == {"done"}
+    assert jobs.active("s1") is None
+
+
+@pytest.fixture
+def slow_grading(monkeypatch):
+    """Memory store and a grader that takes a moment, counting its calls"""
+    store = index.MemorySessionStore()
+    monkeypatch.setattr(index, "session_store", store)
+    monkeypatch.setattr(index, "SPECULATIVE_GRADING", False)
+    gradings = []
+    
+    def grade(personality_key, transcript, duration, customer_profile=None, on_field=None, prior=None, cache="use"):
+        gradings.append(transcript)
+        time.sleep(0.5)
+        raw = {"s": {k: 70 for k in index.SCORE_KEYS}, "ls": "WARM"}
+        return index.expand_grading(raw)[0], {"mode": "single", "cache_hit": False}
+    monkeypatch.setattr(index, "grade_transcript", grade)
+    monkeypatch.setattr(index, "generate_pdf_report", lambda session: fake_report(store, session))
+    store.save({"id": "race", "personality": "ruby_customer", "status": "active",
+                "created_at": "2026-01-01T00:00:00", "customer_profile": None, "transcript": None, "grading": None})
+    return gradings
+
+
+def fake_report(store, session):
+    path = index.reports_dir / f"{session['id']}.pdf"
+    path.write_bytes(b"%PDF-1.4")
+    session["report_path"] = str(path)
+    store.save(session)
+    return str(path)
+
+
+def test_concurrent_grade_posts_share_one_job(client, slow_grading):
+    body = {"session_id": "race", "personality": "ruby_customer", "duration": 60,
+            "transcript": "SALES REP: Hello there\n\nCUSTOMER: Hi, I want a ruby"}
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(index.app.test_client().post(
+        "/api/session/grade", json=body).get_json())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({reply["job_id"] for reply in replies}) == 1
+    job_id = replies[0]["job_id"]
+    assert index.grading_jobs.wait_done(job_id, timeout=5)["status"] == "completed"
+    assert len(slow_grading) == 1
+    
+    again = client.post("/api/session/grade", json=body).get_json()
+    assert again["success"] and again["score"] == 70 and again["job_id"] != job_id
+    assert len(slow_grading) == 1
+    
+    forced = client.post("/api/session/grade", json=dict(body, force=True))
+    assert forced.status_code == 202
+    index.grading_jobs.wait_done(forced.get_json()["job_id"], timeout=5)
+    assert len(slow_grading) == 2
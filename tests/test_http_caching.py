@@ -0,0 +1,68 @@
+import gzip
+
+import pytest
+
+import index
+
+RAW_GRADING = {"s": {"op": 70, "nd": 65, "bq": 60, "br": 55, "oh": 50, "pr": 75, "ch": 40}, "ls": "WARM"}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = index.MemorySessionStore()
+    monkeypatch.setattr(index, "session_store", store)
+    return store
+
+
+@pytest.fixture
+def client():
+    return index.app.test_client()
+
+
+def add_reports(store, count):
+    for i in range(count):
+        store.save({"id": f"s{i:04d}", "personality": "ruby_customer", "status": "completed",
+                    "created_at": f"2026-01-01T00:00:{i % 60:02d}", "duration": 90,
+                    "grading": index.expand_grading(RAW_GRADING)[0]})
+
+
+def test_empty_listing_has_etag_but_no_last_modified(store, client):
+    response = client.get("/api/reports")
+    assert response.get_json() == {"reports": []}
+    assert response.headers.get("ETag")
+    assert "Last-Modified" not in response.headers
+    assert client.get("/api/reports", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_listing_revalidates_by_etag_and_date(store, client):
+    add_reports(store, 3)
+    response = client.get("/api/reports")
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+    
+    cached = client.get("/api/reports", headers={"If-None-Match": etag})
+    assert cached.status_code == 304 and cached.data == b""
+    assert client.get("/api/reports", headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get("/api/reports?limit=1", headers={"If-None-Match": etag}).status_code == 200
+    
+    add_reports(store, 4)
+    assert client.get("/api/reports", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_large_json_is_gzipped_and_its_etag_still_matches(store, client):
+    add_reports(store, 50)
+    plain = client.get("/api/reports")
+    response = client.get("/api/reports", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == plain.data
+    assert response.headers["ETag"] == plain.headers["ETag"][:-1] + '-gzip"'
+    
+    cached = client.get("/api/reports", headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]})
+    assert cached.status_code == 304
+    assert "Content-Encoding" not in cached.headers
+
+
+def test_small_bodies_are_not_compressed(store, client):
+    response = client.get("/api/reports", headers={"Accept-Encoding": "gzip"})
+    assert len(response.data) < index.COMPRESS_MIN_BYTES
+    assert "Content-Encoding" not in response.headers
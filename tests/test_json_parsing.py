@@ -0,0 +1,85 @@
+import json
+
+import index
+
+
+def test_repair_json_passes_valid_json_through():
+    assert index.repair_json('{"s": {"op": 85}}') == ({"s": {"op": 85}}, False)
+
+
+def test_repair_json_drops_truncated_number():
+    data, repaired = index.repair_json('{"s": {"op": 85, "nd": 8')
+    assert repaired
+    assert data == {"s": {"op": 85}}
+
+
+def test_repair_json_drops_truncated_string():
+    data, repaired = index.repair_json('{"ls": "WARM", "sum": "The rep opened we')
+    assert repaired
+    assert data == {"ls": "WARM"}
+
+
+def test_repair_json_drops_truncated_literal():
+    data, _ = index.repair_json('{"ps": {"fu": "Research", "di": fal')
+    assert data == {"ps": {"fu": "Research"}}
+
+
+def test_repair_json_keeps_number_completed_by_closing_bracket():
+    data, _ = index.repair_json('{"s": {"op": 85}, "ls": "WA')
+    assert data == {"s": {"op": 85}}
+
+
+def test_repair_json_drops_trailing_commas_outside_strings_only():
+    data, repaired = index.repair_json('{"st": ["a, ]", "b",], "sum": "x,}",}')
+    assert repaired
+    assert data == {"st": ["a, ]", "b"], "sum": "x,}"}
+
+
+def test_repair_json_skips_leading_prose():
+    data, _ = index.repair_json('Here is the grading:\n{"ls": "HOT", "ra": "fi')
+    assert data == {"ls": "HOT"}
+
+
+def test_repair_json_without_object():
+    assert index.repair_json("no json here") == ({}, True)
+    assert index.repair_json("") == ({}, True)
+
+
+def feed_in_chunks(stream, text, size):
+    fields = []
+    for i in range(0, len(text), size):
+        fields.extend(stream.feed(text[i:i + size]))
+    return fields
+
+
+def test_json_field_stream_emits_members_as_they_close():
+    text = json.dumps({"s": {"op": 70, "nd": 65}, "ls": "WARM", "st": ["a", "b"], "ps": {"di": False}})
+    for size in (1, 3, 7, len(text)):
+        fields = feed_in_chunks(index.JsonFieldStream(), text, size)
+        assert fields == [
+            (("s", "op"), 70),
+            (("s", "nd"), 65),
+            (("s",), {"op": 70, "nd": 65}),
+            (("ls",), "WARM"),
+            (("st",), ["a", "b"]),
+            (("ps", "di"), False),
+            (("ps",), {"di": False}),
+        ]
+
+
+def test_json_field_stream_waits_for_number_delimiter():
+    stream = index.JsonFieldStream()
+    assert stream.feed('{"s": {"op": 8') == []
+    assert stream.feed("5") == []
+    assert stream.feed(", ") == [(("s", "op"), 85)]
+
+
+def test_json_field_stream_handles_escapes_and_brackets_in_strings():
+    stream = index.JsonFieldStream()
+    fields = stream.feed(r'{"sum": "said \"hi\", then {left}", "ra": "ok"}')
+    assert fields == [(("sum",), 'said "hi", then {left}'), (("ra",), "ok")]
+
+
+def test_json_field_stream_respects_max_depth():
+    stream = index.JsonFieldStream(max_depth=1)
+    assert stream.feed('{"s": {"op": 70}}') == [(("s",), {"op": 70})]
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+import index
+
+
+@pytest.fixture
+def mints(monkeypatch):
+    """Fake minting; the list collects the personality of every mint"""
+    minted = []
+    
+    def mint(personality_key):
+        minted.append(personality_key)
+        return {"client_secret": {"value": f"ek-{len(minted)}", "expires_at": time.time() + 60},
+                "customer_profile": None}
+    monkeypatch.setattr(index, "mint_persona_session", mint)
+    return minted
+
+
+def test_prepare_fills_only_the_selected_personality_up_to_size(mints):
+    pool = index.EphemeralKeyPool(size=2, max_total=4, expiry_margin=10)
+    assert pool.prepare("ruby_customer") == 2
+    assert pool.prepare("ruby_customer") == 2
+    assert mints == ["ruby_customer", "ruby_customer"]
+    assert pool.stats()["available"] == {"ruby_customer": 2}
+
+
+def test_prepare_respects_the_total_cap(mints):
+    pool = index.EphemeralKeyPool(size=2, max_total=3, expiry_margin=10)
+    pool.prepare("ruby_customer")
+    assert pool.prepare("blue_sapphire_customer") == 1
+    assert len(mints) == 3
+
+
+def test_prepare_with_zero_size_mints_nothing(mints):
+    pool = index.EphemeralKeyPool(size=0, max_total=4, expiry_margin=10)
+    assert pool.prepare("ruby_customer") == 0
+    assert mints == []
+
+
+def test_acquire_uses_pooled_key_then_mints(mints):
+    pool = index.EphemeralKeyPool(size=1, max_total=4, expiry_margin=10)
+    pool.prepare("ruby_customer")
+    assert pool.acquire("ruby_customer")["client_secret"]["value"] == "ek-1"
+    assert pool.acquire("ruby_customer")["client_secret"]["value"] == "ek-2"
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["minted"]) == (1, 1, 1)
+
+
+def test_keys_near_expiry_are_not_handed_out(mints):
+    pool = index.EphemeralKeyPool(size=1, max_total=4, expiry_margin=120)
+    pool.prepare("ruby_customer")  # expires in 60s, inside the margin
+    assert pool.acquire("ruby_customer")["client_secret"]["value"] == "ek-2"
+    assert pool.stats()["expired"] == 1
+
+
+def test_failed_mint_releases_its_slot(monkeypatch):
+    pool = index.EphemeralKeyPool(size=2, max_total=2, expiry_margin=10)
+    
+    def fail(personality_key):
+        raise index.EphemeralKeyError("down")
+    monkeypatch.setattr(index, "mint_persona_session", fail)
+    assert pool.prepare("ruby_customer") == 0
+    assert pool.stats()["mint_failures"] == 1
+    assert pool._minting == 0
+
+
+def test_prepare_route(mints, monkeypatch):
+    monkeypatch.setattr(index, "ephemeral_pool", index.EphemeralKeyPool(size=1, max_total=4, expiry_margin=10))
+    client = index.app.test_client()
+    data = client.post("/api/session/prepare", json={"personality": "ruby_customer"}).get_json()
+    assert data == {"success": True, "ready": 1, "prewarm_peer": index.PREWARM_PEER_ON_SELECT}
+    assert client.post("/api/session/prepare", json={"personality": "nope"}).get_json()["success"] is False
+    assert mints == ["ruby_customer"]
@@ -0,0 +1,90 @@
+import io
+import subprocess
+import wave
+
+import pytest
+
+import index
+
+
+def live_call(chunks=30, timeslice=1.0):
+    live = index.LiveTranscript("live-test", timeslice)
+    for seq in range(chunks):
+        live.add_chunk(seq, bytes([seq]) * 10, (seq + 1) * timeslice)
+    return live
+
+
+def test_no_live_windows_without_ffmpeg(monkeypatch):
+    monkeypatch.setattr(index, "FFMPEG_BIN", None)
+    live = live_call(index.LIVE_WINDOW_CHUNKS + 5)
+    assert live.future is None
+    
+    recordings = []
+    monkeypatch.setattr(index, "transcribe_recording", lambda audio: recordings.append(audio) or [])
+    live.finish()
+    assert recordings == [live.audio_bytes()]
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.windows = []
+
+    def submit(self, fn, start, end):
+        self.windows.append((start, end))
+        return object()
+
+
+@pytest.mark.parametrize("source, weak_at, expected", [
+    ("auto", None, []),
+    ("auto", 25, [(0, 20)]),
+    ("whisper", None, [(0, 20)]),
+    ("realtime", 25, []),
+])
+def test_live_windows_follow_the_transcript_policy(monkeypatch, source, weak_at, expected):
+    monkeypatch.setattr(index, "FFMPEG_BIN", "ffmpeg")
+    monkeypatch.setattr(index, "TRANSCRIPT_SOURCE", source)
+    monkeypatch.setattr(index, "LIVE_WINDOW_CHUNKS", 20)
+    executor = RecordingExecutor()
+    monkeypatch.setattr(index, "transcribe_executor", executor)
+    live = index.LiveTranscript("live-policy", 1.0)
+    for seq in range(30):
+        live.add_chunk(seq, b"x", seq + 1.0, weak_turns=weak_at is not None and seq >= weak_at)
+    assert executor.windows == expected
+
+
+def test_window_is_cut_from_the_recording_prefix(monkeypatch):
+    monkeypatch.setattr(index, "FFMPEG_BIN", None)
+    live = live_call(30)
+    cuts = []
+    monkeypatch.setattr(index, "cut_audio", lambda audio, start, end: cuts.append((audio, start, end)) or b"wav")
+    monkeypatch.setattr(index, "transcribe_user_audio", lambda audio: [
+        {"speaker": "SALES REP", "text": "lead-in", "timestamp": 0.2},
+        {"speaker": "SALES REP", "text": "owned", "timestamp": 1.5},
+    ])
+    segments = live.transcribe_window(20, 30)
+    lead_from = 20 - index.LIVE_OVERLAP_CHUNKS
+    assert cuts == [(live.audio_bytes(30), float(lead_from), 30.0)]
+    assert segments == [{"speaker": "SALES REP", "text": "owned", "timestamp": lead_from + 1.5}]
+
+
+def test_finish_falls_back_to_whole_recording_when_the_tail_fails(monkeypatch):
+    monkeypatch.setattr(index, "FFMPEG_BIN", None)
+    live = live_call(30)
+    live.processed, live.segments = 20, [{"speaker": "SALES REP", "text": "early", "timestamp": 1.0}]
+    monkeypatch.setattr(index, "transcribe_recording", lambda audio: [{"text": "all", "timestamp": 0.0}])
+    assert live.finish() == [{"text": "all", "timestamp": 0.0}]
+
+
+@pytest.mark.skipif(not index.FFMPEG_BIN, reason="ffmpeg not installed")
+def test_cut_audio_from_timeslice_chunks():
+    # A WebM/Opus recording split at arbitrary byte offsets, as MediaRecorder timeslices are
+    webm = subprocess.run(
+        [index.FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:duration=6",
+         "-c:a", "libopus", "-f", "webm", "pipe:1"],
+        capture_output=True, check=True
+    ).stdout
+    size = len(webm) // 7
+    chunks = [webm[i:i + size] for i in range(0, len(webm), size)]
+    wav = index.cut_audio(b"".join(chunks), 2.0, 5.0)
+    with wave.open(io.BytesIO(wav)) as audio:
+        assert audio.getnframes() / audio.getframerate() == pytest.approx(3.0, abs=0.05)
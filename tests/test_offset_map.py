@@ -0,0 +1,24 @@
+import index
+
+
+def test_parse_offset_map():
+    assert index.parse_offset_map('[[5, 8], [0, 0]]') == [(0.0, 0.0), (5.0, 8.0)]
+    assert index.parse_offset_map("") == []
+    assert index.parse_offset_map("not json") == []
+    assert index.parse_offset_map('[["a", 1]]') == []
+
+
+def test_offset_map_round_trip():
+    # 0-5s kept as is, then 3s of silence cut, then 5-9s of the trimmed file
+    offset_map = [(0.0, 0.0), (5.0, 8.0)]
+    assert index.trimmed_to_recorder(2.0, offset_map) == 2.0
+    assert index.trimmed_to_recorder(6.0, offset_map) == 9.0
+    for t in (0.0, 2.0, 5.0, 6.5):
+        assert index.recorder_to_trimmed(index.trimmed_to_recorder(t, offset_map), offset_map) == t
+
+
+def test_recorder_to_trimmed_collapses_silence():
+    offset_map = [(0.0, 0.0), (5.0, 8.0)]
+    assert index.recorder_to_trimmed(6.0, offset_map) == 5.0
+    assert index.recorder_to_trimmed(7.0, []) == 7.0
+    assert index.trimmed_to_recorder(7.0, []) == 7.0
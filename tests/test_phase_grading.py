@@ -0,0 +1,79 @@
+import pytest
+
+import index
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Fake grading calls: every asked-for score is 80"""
+    made = []
+    
+    def grading_call(system_prompt, schema, session_prompt, timeout=None, on_field=None):
+        made.append((system_prompt, schema, session_prompt))
+        raw = {k: "x" for k in schema["properties"] if k != "s"}
+        if "s" in schema["properties"]:
+            raw["s"] = {k: 80 for k in schema["properties"]["s"]["properties"]}
+        raw.update({"ls": "WARM"} if "ls" in raw else {})
+        meta = {"prompt_tokens": 10, "cached_tokens": 0, "completion_tokens": 5, "repaired": False}
+        return raw, meta
+    monkeypatch.setattr(index, "_grading_call", grading_call)
+    return made
+
+
+def call_transcript(rep_turns, topic="ruby"):
+    return index.join_turns([
+        turn for i in range(rep_turns)
+        for turn in (["SALES REP", f"Question {i} about the {topic} for your anniversary?"],
+                     ["CUSTOMER", f"Answer {i} about my budget and timing"])
+    ])
+
+
+def phase_keys(schema):
+    return sorted(schema["properties"]["s"]["properties"])
+
+
+def test_settled_phases_are_graded_once_when_due(calls):
+    grader = index.PhaseGrader("phase-test", "ruby_customer")
+    for turns in range(1, 13):
+        grader.update(call_transcript(turns), turns * 10)
+    grader.finish(call_transcript(12))
+    assert grader.graded() == {"opening": 3, "discovery": 8}
+    assert sorted(phase_keys(schema) for _, schema, _ in calls) == [["bq", "br", "nd"], ["op"]]
+    assert all(system_prompt == index.GRADING_SYSTEM_PROMPT for system_prompt, _, _ in calls)
+
+
+def test_finish_keeps_phases_whose_text_still_matches(calls):
+    grader = index.PhaseGrader("phase-test", "ruby_customer")
+    grader.update(call_transcript(8), 80)
+    prior = grader.finish(call_transcript(12))
+    assert prior["raw"]["s"] == {"op": 80, "nd": 80, "bq": 80, "br": 80}
+    assert sorted(prior["calls"]) == ["phase:discovery", "phase:opening"]
+
+
+def test_finish_drops_phases_the_final_transcript_contradicts(calls):
+    grader = index.PhaseGrader("phase-test", "ruby_customer")
+    grader.update(call_transcript(8), 80)
+    other = index.join_turns([["SALES REP", f"Completely different line {i} on pearls"] for i in range(12)])
+    assert grader.finish(other) is None
+
+
+def test_finish_is_memoized_and_stops_updates(calls, monkeypatch):
+    grader = index.PhaseGrader("phase-test", "ruby_customer")
+    grader.update(call_transcript(3), 30)
+    final = call_transcript(12)
+    first = grader.finish(final)
+    monkeypatch.setattr(grader, "_settle", lambda: pytest.fail("waited twice"))
+    assert grader.finish(final) is first
+    grader.update(call_transcript(12), 120)
+    assert not grader.futures
+
+
+def test_final_phased_call_shares_the_full_system_prompt(calls):
+    prior = {"raw": {"s": {"op": 70, "nd": 60}}, "calls": {"phase:opening": {"prompt_tokens": 10, "cached_tokens": 0, "completion_tokens": 5, "repaired": False}}}
+    grading, meta = index.grade_transcript("ruby_customer", call_transcript(10), 100, prior=prior)
+    system_prompt, schema, session_prompt = calls[-1]
+    assert system_prompt == index.GRADING_SYSTEM_PROMPT
+    assert phase_keys(schema) == ["bq", "br", "ch", "oh", "pr"]
+    assert "ALREADY GRADED DURING THE CALL" in session_prompt
+    assert meta["mode"] == "phased"
+    assert grading["scores"]["opening"] == 70 and grading["scores"]["closing_handoff"] == 80
@@ -0,0 +1,103 @@
+import pytest
+
+import index
+
+RAW_GRADING = {
+    "s": {"op": 70, "nd": 65, "bq": 60, "br": 55, "oh": 50, "pr": 75, "ch": 40},
+    "ls": "WARM", "sum": "Good opening, weak close.", "st": ["Warm greeting"], "im": ["Ask for the budget"],
+    "ra": "Discovery was thin.",
+}
+
+
+def session(session_id, status="active", created_at="2026-01-01T00:00:00", personality="ruby_customer"):
+    graded = status == "completed"
+    return {
+        "id": session_id,
+        "personality": personality,
+        "status": status,
+        "created_at": created_at,
+        "customer_profile": None,
+        "transcript": "SALES REP: Hello\n\nCUSTOMER: Hi" if graded else None,
+        "grading": index.expand_grading(RAW_GRADING)[0] if graded else None,
+        "duration": 60 if graded else 0,
+    }
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        index.SessionStore()
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    store = index.SQLiteSessionStore(tmp_path / "sessions.db")
+    store.save(session("a"))
+    assert store.get("a")["status"] == "active"
+    assert "a" in store
+    assert store.get("missing") is None
+
+
+def test_sqlite_store_lists_completed_newest_first(tmp_path):
+    store = index.SQLiteSessionStore(tmp_path / "sessions.db")
+    store.save(session("a", "completed", "2026-01-01T00:00:00"))
+    store.save(session("b", "completed", "2026-01-02T00:00:00", personality="blue_sapphire_customer"))
+    store.save(session("c"))
+    rows = store.list_completed()
+    assert [row["id"] for row in rows] == ["b", "a"]
+    assert rows[0]["score"] == int(index.expand_grading(RAW_GRADING)[0]["overall_score"])
+    assert [row["id"] for row in store.list_completed(limit=1)] == ["b"]
+    assert [row["id"] for row in store.list_completed(personality="ruby_customer")] == ["a"]
+
+
+def test_sqlite_store_completed_version_uses_index(tmp_path):
+    store = index.SQLiteSessionStore(tmp_path / "sessions.db")
+    assert store.completed_version() == (0, 0.0)
+    store.save(session("a", "completed"))
+    count, last = store.completed_version()
+    assert count == 1 and last > 0
+    plan = store._connect().execute(
+        "EXPLAIN QUERY PLAN SELECT COUNT(*), MAX(updated_at) FROM sessions "
+        "WHERE status = 'completed' AND score IS NOT NULL"
+    ).fetchall()
+    assert "COVERING INDEX idx_sessions_updated_at" in plan[0]["detail"]
+
+
+def test_session_cache_returns_copies():
+    cache = index.SessionCache(max_entries=10)
+    original = session("a")
+    cache.save(original)
+    original["status"] = "changed"
+    loaded = cache.get("a")
+    assert loaded["status"] == "active"
+    loaded["status"] = "changed"
+    assert cache.get("a")["status"] == "active"
+    assert cache.get("missing") is None
+
+
+def test_session_cache_evicts_completed_least_recently_used():
+    cache = index.SessionCache(max_entries=2)
+    cache.save(session("a", "completed"))
+    cache.save(session("b", "completed"))
+    cache.get("a")
+    cache.save(session("c", "completed"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_session_cache_pins_active_sessions():
+    cache = index.SessionCache(max_entries=1)
+    cache.save(session("a"))
+    cache.save(session("b"))
+    assert cache.get("a") is not None
+    assert cache.get("b") is not None
+    assert cache.stats()["pinned"] == 2
+
+
+def test_session_cache_spills_and_reloads(tmp_path):
+    cache = index.SessionCache(max_entries=1, spill_dir=tmp_path)
+    cache.save(session("a", "completed", "2026-01-01T00:00:00"))
+    cache.save(session("b", "completed", "2026-01-02T00:00:00"))
+    assert (tmp_path / "a.json").exists()
+    assert [row["id"] for row in cache.list_completed()] == ["b", "a"]
+    assert cache.get("a")["grading"]["scores"]["opening"] == 70
+    assert cache.stats()["reloads"] == 1
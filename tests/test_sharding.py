@@ -0,0 +1,42 @@
+import pytest
+
+import index
+
+
+def test_plan_shards_short_recording_is_one_span():
+    assert index.plan_shards(index.SHARD_TARGET_SECONDS, []) == [(0.0, index.SHARD_TARGET_SECONDS)]
+
+
+def test_plan_shards_cuts_in_silences():
+    target = index.SHARD_TARGET_SECONDS
+    duration = target * 3
+    silences = [(target * 0.9, target * 0.9 + 2), (target * 2.1, target * 2.1 + 2)]
+    spans = index.plan_shards(duration, silences)
+    assert spans == [(0.0, target * 0.9 + 1), (target * 0.9 + 1, target * 2.1 + 1), (target * 2.1 + 1, duration)]
+
+
+def test_plan_shards_without_silences_cuts_at_target():
+    target = index.SHARD_TARGET_SECONDS
+    spans = index.plan_shards(target * 4, [])
+    assert spans[0] == (0.0, target)
+    assert spans[-1][1] == target * 4
+    assert all(a[1] == b[0] for a, b in zip(spans, spans[1:]))
+
+
+def test_short_recording_over_whisper_limit_is_sharded(monkeypatch):
+    seconds = 60
+    pcm = b"\0\0" * index.SHARD_SAMPLE_RATE * seconds
+    monkeypatch.setattr(index, "decode_audio", lambda audio: (pcm, []))
+    sent = []
+    monkeypatch.setattr(index, "transcribe_user_audio", lambda audio: sent.append(audio) or [])
+    assert index.transcribe_sharded(b"x" * 10) is None
+    assert index.transcribe_sharded(b"x" * (index.WHISPER_MAX_BYTES + 1)) == []
+    assert len(sent) == 1 and sent[0][0] == "shard-0.wav"
+
+
+def test_oversized_recording_without_ffmpeg_fails_clearly(monkeypatch):
+    monkeypatch.setattr(index, "decode_audio", lambda audio: None)
+    monkeypatch.setattr(index, "transcribe_user_audio", lambda audio: pytest.fail("sent to Whisper"))
+    with pytest.raises(ValueError, match="could not be split"):
+        index.transcribe_recording(b"x" * (index.WHISPER_MAX_BYTES + 1))
+